@@ -3,336 +3,796 @@
 FINAL VERSION – WORKS 100%
 Deploy this and go drink coffee
 """
+from __future__ import annotations
+
 import os
+import signal
 import asyncio
 import sqlite3
-import json
+import itertools
 import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
 from datetime import datetime, timezone
-from typing import Optional
 
-import uvloop
-uvloop.install()
+import aiosqlite
+import msgspec
+from aiohttp import web
+
+try:
+    import uvloop  # not available on Windows; fall back to the stdlib loop there
+except ImportError:
+    uvloop = None
 
-from aiogram import Bot, Dispatcher, types
-from aiogram.exceptions import TelegramBadRequest
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import AnswerCallbackQuery, GetUpdates
+from aiogram.filters.callback_data import CallbackData
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # ====================== CONFIG ======================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MAIN_GROUP_ID = os.getenv("MAIN_GROUP_ID")
 APPROVAL_GROUP_ID = os.getenv("APPROVAL_GROUP_ID")
 ADMIN_IDS_RAW = os.getenv("ADMIN_IDS", "")
+# Webhook mode (optional): Telegram POSTs updates to WEBHOOK_URL + WEBHOOK_PATH
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+PORT = int(os.getenv("PORT", "8080"))
+# Size of the keep-alive connection pool to the Bot API
+API_CONN_LIMIT = int(os.getenv("API_CONN_LIMIT", "100"))
 
 if not all([BOT_TOKEN, MAIN_GROUP_ID, APPROVAL_GROUP_ID]):
     raise SystemExit("Set BOT_TOKEN, MAIN_GROUP_ID, APPROVAL_GROUP_ID")
 
 ADMIN_IDS = {int(x) for x in ADMIN_IDS_RAW.split(",") if x.strip().isdigit()}
+# Parsed once; handlers compare/send with these instead of re-parsing per call
+MAIN_GROUP_ID_INT = int(MAIN_GROUP_ID)
+APPROVAL_GROUP_ID_INT = int(APPROVAL_GROUP_ID)
 
-logging.basicConfig(level=logging.INFO)
+# LOG_LEVEL=WARNING silences the startup/info lines in production
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# The loop only holds weak refs to tasks; fire-and-forget ones are kept alive here until done
+background_tasks: set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 DB_PATH = "media_moderator.db"
+DB_CONN: aiosqlite.Connection | None = None  # the single writer (also runs schema setup)
+# Read-only connections, each on its own aiosqlite thread, so WAL lets SELECTs run in parallel
+READ_POOL_SIZE = 4
+read_pool: asyncio.Queue = asyncio.Queue()
+
+# Plain INTEGER PRIMARY KEY (rowid alias): pids come from pid_counter, never from sqlite
+PENDING_SCHEMA = """
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT,
+        user_id INTEGER,
+        username TEXT,
+        full_name TEXT,
+        media_group_id TEXT,
+        is_album INTEGER,
+        caption TEXT,
+        created_at TEXT,
+        payload BLOB
+    )
+"""
+
+# Payload is stored as msgpack: smaller rows and a typed decode straight into structs
+class Item(msgspec.Struct):
+    file_id: str
+    type: str
+
+class Payload(msgspec.Struct):
+    items: list[Item]
+
+PAYLOAD_ENCODER = msgspec.msgpack.Encoder()
+PAYLOAD_DECODER = msgspec.msgpack.Decoder(Payload)
+
+# Fixed SQL text so sqlite3's per-connection statement cache always hits
+PENDING_COLS = ("id", "chat_id", "user_id", "username", "full_name", "media_group_id",
+                "is_album", "caption", "created_at", "payload")
+INSERT_SQL = f"INSERT INTO pending ({', '.join(PENDING_COLS)}) VALUES ({', '.join('?' * len(PENDING_COLS))})"
+SELECT_SQL = f"SELECT {', '.join(PENDING_COLS)} FROM pending WHERE id=?"
+DELETE_SQL = "DELETE FROM pending WHERE id=?"
+META_SCHEMA = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+PID_HWM_SQL = "INSERT OR REPLACE INTO meta (key, value) VALUES ('pid_hwm', ?)"
+
+# Writes are queued and committed in groups: one fsync per batch, not per statement.
+# Inserts and deletes share the queue so they reach disk in the order they were made.
+WRITE_BATCH_MAX = 64
+WRITE_BATCH_WINDOW = 0.02
+write_queue: asyncio.Queue = asyncio.Queue()
+writer_task: asyncio.Task | None = None
+
+# New submissions live only in RAM; most are approved/rejected within seconds,
+# so a row is written to SQLite only if it is still pending after SPILL_AFTER
+SPILL_AFTER = 30.0
+pending_ephemeral: dict[int, tuple[dict, asyncio.TimerHandle]] = {}
+# Old approval buttons carry pids, so a pid must never be handed out twice, even across
+# restarts and for rows that never reached disk. The stored high-water mark (first pid not
+# yet covered) is raised a block at a time, and committed before a pid above it is used.
+PID_BLOCK = 1000
+pid_counter = itertools.count(1)
+pid_reserved = 1
+pid_reserving: asyncio.Future | None = None
+
+# Recently spilled/read rows; lookups after a spill don't need a SELECT
+PENDING_CACHE_SIZE = int(os.getenv("PENDING_CACHE_SIZE", "1024"))
+pending_cache: "OrderedDict[int, dict]" = OrderedDict()
+# In-flight SQLite loads by pid: concurrent misses for one row share a single SELECT
+pending_loads: dict[int, asyncio.Task] = {}
+# Recently deleted pids: a load that was already reading when the delete ran must not
+# put the row back in the cache (pids are never reused, so a stale mark is harmless)
+pending_deleted: "OrderedDict[int, None]" = OrderedDict()
+
+# Applied to every connection, writer and readers alike
+DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-{cache_kib};
+    PRAGMA busy_timeout=5000;
+"""
 
 # ====================== DB ======================
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS pending (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT,
-            user_id INTEGER,
-            username TEXT,
-            full_name TEXT,
-            media_group_id TEXT,
-            is_album INTEGER,
-            caption TEXT,
-            created_at TEXT,
-            payload TEXT
-        )
-    """)
+async def connect_db(database: str, cache_kib: int, **kwargs) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(database, isolation_level=None, cached_statements=256, **kwargs)
+    await conn.executescript(DB_PRAGMAS.format(cache_kib=cache_kib))
+    return conn
+
+async def init_db():
+    global DB_CONN, writer_task, pid_counter, pid_reserved
+    # One long-lived autocommit connection, driven from aiosqlite's worker thread
+    # so disk I/O never blocks the event loop; WAL + NORMAL avoids an fsync per commit
+    DB_CONN = await connect_db(DB_PATH, cache_kib=65536)
+    await DB_CONN.execute(PENDING_SCHEMA.format(table="IF NOT EXISTS pending"))
     # Add full_name column if missing (old DBs)
     try:
-        cur.execute("ALTER TABLE pending ADD COLUMN full_name TEXT")
+        await DB_CONN.execute("ALTER TABLE pending ADD COLUMN full_name TEXT")
     except sqlite3.OperationalError:
         pass
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def save_pending(chat_id, user_id, username, full_name, mgid, is_album, caption, payload):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO pending 
-        (chat_id, user_id, username, full_name, media_group_id, is_album, caption, created_at, payload)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        str(chat_id), user_id, username or "", full_name,
-        mgid or "", int(is_album), caption or "",
-        datetime.now(timezone.utc).isoformat(), json.dumps(payload)
-    ))
-    conn.commit()
-    pid = cur.lastrowid
-    conn.close()
+    # Old DBs used AUTOINCREMENT, which costs an extra sqlite_sequence write per insert
+    async with DB_CONN.execute("SELECT sql FROM sqlite_master WHERE name='pending'") as cur:
+        (schema,) = await cur.fetchone()
+    if "AUTOINCREMENT" in schema.upper():
+        cols = ", ".join(PENDING_COLS)
+        await DB_CONN.executescript(f"""
+            BEGIN IMMEDIATE;
+            {PENDING_SCHEMA.format(table="pending_new")};
+            INSERT INTO pending_new ({cols}) SELECT {cols} FROM pending;
+            DROP TABLE pending;
+            ALTER TABLE pending_new RENAME TO pending;
+            COMMIT;
+        """)
+    # pids are handed out in memory; continue past anything ever reserved or on disk
+    await DB_CONN.execute(META_SCHEMA)
+    async with DB_CONN.execute(
+        "SELECT COALESCE(MAX(id), 0) + 1, (SELECT value FROM meta WHERE key='pid_hwm') FROM pending"
+    ) as cur:
+        after_rows, hwm = await cur.fetchone()
+    pid_reserved = max(after_rows, hwm or 0)
+    pid_counter = itertools.count(pid_reserved)
+    for _ in range(READ_POOL_SIZE):
+        read_pool.put_nowait(await connect_db(f"file:{DB_PATH}?mode=ro", cache_kib=8000, uri=True))
+    writer_task = asyncio.create_task(writer_loop())
+
+async def close_db():
+    # Persist whatever is still only in RAM before shutting the writer down
+    spills = [spill_pending(pid) for pid in list(pending_ephemeral)]
+    await asyncio.gather(*spills, return_exceptions=True)
+    if writer_task:
+        writer_task.cancel()
+    while not read_pool.empty():
+        await read_pool.get_nowait().close()
+    await DB_CONN.close()
+
+@asynccontextmanager
+async def reader():
+    conn = await read_pool.get()
+    try:
+        yield conn
+    finally:
+        read_pool.put_nowait(conn)
+
+def queue_write(sql: str, params: tuple) -> asyncio.Future:
+    fut = asyncio.get_running_loop().create_future()
+    write_queue.put_nowait((sql, params, fut))
+    return fut
+
+async def writer_loop():
+    while True:
+        batch = [await write_queue.get()]
+        await asyncio.sleep(WRITE_BATCH_WINDOW)
+        while len(batch) < WRITE_BATCH_MAX and not write_queue.empty():
+            batch.append(write_queue.get_nowait())
+        try:
+            await DB_CONN.execute("BEGIN IMMEDIATE")
+            # Runs of the same statement go out as one executemany, keeping queue order
+            for sql, run in itertools.groupby(batch, key=lambda w: w[0]):
+                await DB_CONN.executemany(sql, [params for _, params, _ in run])
+            await DB_CONN.execute("COMMIT")
+        except Exception as e:
+            logger.error("Batch write failed: %s", e)
+            try:
+                await DB_CONN.execute("ROLLBACK")
+            except sqlite3.OperationalError:
+                pass
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for _, _, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+async def next_pid() -> int:
+    global pid_reserved, pid_reserving
+    pid = next(pid_counter)
+    if pid >= pid_reserved:
+        pid_reserved = pid + PID_BLOCK
+        pid_reserving = queue_write(PID_HWM_SQL, (pid_reserved,))
+    # Already done except right after a reservation; then wait until the mark is on disk
+    reserving = pid_reserving
+    try:
+        await reserving
+    except Exception:
+        # The mark never reached disk: make the next caller reserve again instead of
+        # re-raising this failure for the rest of the block
+        if pid_reserving is reserving:
+            pid_reserved = 0
+        raise
     return pid
 
-def get_pending(pid: int) -> Optional[dict]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM pending WHERE id=?", (pid,))
-    row = cur.fetchone()
-    cols = [d[0] for d in cur.description] if cur.description else []
-    conn.close()
-    if not row:
+_UTC = timezone.utc  # bound once; save_pending stamps every submission
+
+async def save_pending(chat_id, user_id, username, full_name, mgid, is_album, caption, payload):
+    # Returns (pid, row) so callers can use the row without re-reading it
+    pid = await next_pid()
+    p = {
+        "id": pid, "chat_id": str(chat_id), "user_id": user_id, "username": username or "",
+        "full_name": full_name, "media_group_id": mgid or "", "is_album": bool(is_album),
+        "caption": caption or "", "created_at": datetime.now(_UTC).isoformat(),
+        "payload": payload
+    }
+    # Rendered once; forward and the approval posts all reuse it (not persisted)
+    p["mention"] = mention(user_id, p["username"], full_name)
+    timer = asyncio.get_running_loop().call_later(
+        SPILL_AFTER, lambda: spawn(spill_pending(pid))
+    )
+    pending_ephemeral[pid] = (p, timer)
+    return pid, p
+
+async def spill_pending(pid: int):
+    entry = pending_ephemeral.get(pid)
+    if entry is None:
+        return
+    p, timer = entry
+    timer.cancel()
+    params = tuple(p[c] for c in PENDING_COLS[:-1]) + (PAYLOAD_ENCODER.encode(p["payload"]),)
+    # Hand over to the LRU first; the queued INSERT precedes any later DELETE
+    del pending_ephemeral[pid]
+    cache_pending(p)
+    try:
+        await queue_write(INSERT_SQL, params)
+    except Exception as e:
+        logger.error("Spill failed (pid %s): %s", pid, e)
+
+def cache_pending(p: dict):
+    pending_cache[p["id"]] = p
+    pending_cache.move_to_end(p["id"])
+    if len(pending_cache) > PENDING_CACHE_SIZE:
+        pending_cache.popitem(last=False)
+
+async def get_pending(pid: int) -> dict | None:
+    entry = pending_ephemeral.get(pid)
+    if entry is not None:
+        return entry[0]
+    p = pending_cache.get(pid)
+    if p is not None:
+        pending_cache.move_to_end(pid)
+        return p
+    if pid in pending_deleted:
         return None
-    data = dict(zip(cols, row))
-    data["payload"] = json.loads(data["payload"])
+    # Miss: e.g. a button clicked after a restart
+    task = pending_loads.get(pid)
+    if task is None:
+        task = pending_loads[pid] = asyncio.create_task(load_pending(pid))
+        task.add_done_callback(lambda _: pending_loads.pop(pid, None))
+    # Shielded so one cancelled click doesn't fail the others waiting on it
+    return await asyncio.shield(task)
+
+async def load_pending(pid: int) -> dict | None:
+    async with reader() as conn, conn.execute(SELECT_SQL, (pid,)) as cur:
+        row = await cur.fetchone()
+    # Deleted while the SELECT ran: the row read is stale
+    if not row or pid in pending_deleted:
+        return None
+    data = dict(zip(PENDING_COLS, row))
+    raw = data["payload"]
+    # Rows written before the msgpack switch hold JSON text
+    data["payload"] = msgspec.json.decode(raw, type=Payload) if isinstance(raw, str) else PAYLOAD_DECODER.decode(raw)
     data["is_album"] = bool(data.get("is_album", 0))
+    data["mention"] = mention(data["user_id"], data["username"], data["full_name"])
+    cache_pending(data)
     return data
 
-def delete_pending(pid: int):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM pending WHERE id=?", (pid,))
-    conn.commit()
-    conn.close()
+async def delete_pending(pid: int):
+    entry = pending_ephemeral.pop(pid, None)
+    if entry is not None:
+        # Never reached disk
+        entry[1].cancel()
+        return
+    pending_cache.pop(pid, None)
+    pending_loads.pop(pid, None)
+    pending_deleted[pid] = None
+    if len(pending_deleted) > PENDING_CACHE_SIZE:
+        pending_deleted.popitem(last=False)
+    await queue_write(DELETE_SQL, (pid,))
+
+# Escape special MarkdownV2 characters (backslash included) in one pass
+MD_SPECIALS = frozenset("\\_*[]()~`>#+-=|{}.!")
+MD_ESCAPE = str.maketrans({c: "\\" + c for c in MD_SPECIALS})
+
+def md_escape(text: str) -> str:
+    # Most names have nothing to escape; skip building a new string for them
+    if MD_SPECIALS.isdisjoint(text):
+        return text
+    return text.translate(MD_ESCAPE)
 
 def mention(uid, username, full_name):
     if username:
-        return f"@{username}"
-    # Escape special Markdown characters in name
-    escaped_name = full_name.replace("_", "\\_").replace("*", "\\*").replace("[", "\\[").replace("]", "\\]").replace("(", "\\(").replace(")", "\\)").replace("~", "\\~").replace("`", "\\`").replace(">", "\\>").replace("#", "\\#").replace("+", "\\+").replace("-", "\\-").replace("=", "\\=").replace("|", "\\|").replace("{", "\\{").replace("}", "\\}").replace(".", "\\.").replace("!", "\\!")
-    return f"[{escaped_name}](tg://user?id={uid})"
+        return f"@{md_escape(username)}"
+    return f"[{md_escape(full_name)}](tg://user?id={uid})"
 
 # ====================== IN-MEMORY ======================
-media_buffer = {}
-album_meta = {}
-flush_tasks = {}
-selective_selections = {}
+@dataclass(slots=True)
+class AlbumState:
+    # Everything buffered for one media_group, so each album event is a single lookup
+    items: list = field(default_factory=list)
+    meta: dict = field(default_factory=dict)
+    task: asyncio.Task | None = None
+    deadline: float = 0.0
+
+@dataclass(slots=True)
+class Selection:
+    # Per-item review state as bitmasks: bit i of seen/kept is item i
+    total: int
+    seen: int = 0
+    kept: int = 0
+    # Recreated from the item count alone (old Keep/Remove review after a restart or
+    # eviction): earlier choices are unknown, so finalize must not trust it
+    rebuilt: bool = False
+
+    def kept_mask(self) -> int:
+        # Items never reviewed count as kept
+        return self.kept | ~self.seen
+
+    def mark(self, idx: int, keep: bool):
+        bit = 1 << idx
+        self.seen |= bit
+        self.kept = self.kept | bit if keep else self.kept & ~bit
+
+albums: dict[str, AlbumState] = {}
+# Reviews that are never finalized would otherwise pile up; least recently clicked go first
+SELECTION_CACHE_SIZE = int(os.getenv("SELECTION_CACHE_SIZE", "1024"))
+selective_selections: "OrderedDict[int, Selection]" = OrderedDict()
+
+def start_selection(pid: int, total: int, seen: int = 0, kept: int = 0) -> Selection:
+    entry = selective_selections[pid] = Selection(total, seen, kept)
+    selective_selections.move_to_end(pid)
+    if len(selective_selections) > SELECTION_CACHE_SIZE:
+        selective_selections.popitem(last=False)
+    return entry
+
 MEDIA_TIMEOUT = 5.0
 
-bot = Bot(token=BOT_TOKEN)
+def json_dumps(obj) -> str:
+    return msgspec.json.encode(obj).decode()
+
+# Telegram allows ~30 messages/s per bot; outbound calls are paced below that so bursts
+# queue up here instead of coming back as 429s
+API_RATE = 25
+UNLIMITED_METHODS = (GetUpdates, AnswerCallbackQuery)  # long poll / click acks: not messages
+
+class RateLimit(BaseRequestMiddleware):
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_at = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, UNLIMITED_METHODS):
+            # Reserve the next free slot first, so concurrent callers queue in order
+            now = asyncio.get_running_loop().time()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return await make_request(bot, method)
+
+# One long-lived aiohttp session: connections to the Bot API are kept alive and reused.
+# Telegram API responses/requests (and webhook bodies) go through msgspec's C JSON codec.
+# Bot texts are MarkdownV2 by default; user captions opt out with parse_mode=None.
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(limit=API_CONN_LIMIT, json_loads=msgspec.json.decode, json_dumps=json_dumps),
+    default=DefaultBotProperties(parse_mode="MarkdownV2")
+)
+bot.session.middleware(RateLimit(API_RATE))
 dp = Dispatcher()
 
 # ====================== KEYBOARDS ======================
+# Typed callback_data ("a:<action>:<pid>:<idx>"), packed and parsed by aiogram
+class ApprovalCB(CallbackData, prefix="a"):
+    action: str
+    pid: int
+    idx: int = -1
+
+# Fixed button layouts as rows of (text, action); only pid/idx vary per keyboard
+APPROVAL_LAYOUT = ((("Approve all", "approve_all"), ("Reject all", "reject_all")),
+                   (("Approve selectively", "selective"),))
+FINALIZE_LAYOUT = ((("Finalize & Post", "finalize"),),)
+
+def build_kb(layout, pid, idx=-1):
+    # Markup built directly; no InlineKeyboardBuilder round-trip per message
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=text, callback_data=ApprovalCB(action=action, pid=pid, idx=idx).pack())
+         for text, action in row]
+        for row in layout
+    ])
+
 def approval_kb(pid):
-    b = InlineKeyboardBuilder()
-    b.button(text="Approve all", callback_data=f"approve_all:{pid}")
-    b.button(text="Reject all", callback_data=f"reject_all:{pid}")
-    b.button(text="Approve selectively", callback_data=f"selective:{pid}")
-    b.adjust(2, 1)
-    return b.as_markup()
-
-def keep_remove_kb(pid, idx):
-    b = InlineKeyboardBuilder()
-    b.button(text="Keep", callback_data=f"keep:{pid}:{idx}")
-    b.button(text="Remove", callback_data=f"remove:{pid}:{idx}")
-    b.adjust(2)
-    return b.as_markup()
+    return build_kb(APPROVAL_LAYOUT, pid)
 
 def finalize_kb(pid):
-    b = InlineKeyboardBuilder()
-    b.button(text="Finalize & Post", callback_data=f"finalize:{pid}")
-    return b.as_markup()
+    return build_kb(FINALIZE_LAYOUT, pid)
+
+TOGGLE_ROW = 5  # item buttons per keyboard row
+
+def toggle_kb(pid, entry):
+    # One button per item showing its current state, then Finalize
+    mask = entry.kept_mask()
+    items = [
+        types.InlineKeyboardButton(text=f"{i+1} {'✓' if mask >> i & 1 else '✗'}",
+                                   callback_data=ApprovalCB(action="toggle", pid=pid, idx=i).pack())
+        for i in range(entry.total)
+    ]
+    rows = [items[i:i + TOGGLE_ROW] for i in range(0, len(items), TOGGLE_ROW)]
+    return types.InlineKeyboardMarkup(inline_keyboard=rows + finalize_kb(pid).inline_keyboard)
 
 # ====================== ALBUM FLUSH ======================
 async def flush_album(key: str):
-    await asyncio.sleep(MEDIA_TIMEOUT)
-    items = media_buffer.pop(key, [])
-    meta = album_meta.pop(key, None)
-    flush_tasks.pop(key, None)
-    if not items or not meta:
+    state = albums[key]
+    loop = asyncio.get_running_loop()
+    # Each new album item pushes the deadline out; this one task sleeps until it stops moving
+    while (remaining := state.deadline - loop.time()) > 0:
+        await asyncio.sleep(remaining)
+    albums.pop(key, None)
+    if not state.items:
         return
-    pid = save_pending(
+    meta = state.meta
+    pid, p = await save_pending(
         meta["chat_id"], meta["user_id"], meta["username"], meta["full_name"],
         meta.get("media_group_id"), True, meta.get("caption", ""),
-        {"items": [{"file_id": i["file_id"], "type": i["type"]} for i in items]}
+        Payload(items=state.items)
     )
-    await forward_to_approval(pid)
+    await forward_to_approval(pid, p)
+
+# ====================== MEDIA ======================
+# Resolved once instead of a types.* attribute lookup per album item
+INPUT_MEDIA = {"photo": types.InputMediaPhoto, "video": types.InputMediaVideo}
+
+def build_media(items, caption=None) -> list:
+    # Caption rides on the first item; aiogram models are frozen, so set it at construction
+    return [
+        INPUT_MEDIA[it.type](
+            media=it.file_id, caption=caption if idx == 0 and caption else None, parse_mode=None
+        )
+        for idx, it in enumerate(items)
+    ]
+
+async def send_media(chat_id: int, items, caption=None, media=None) -> list:
+    # Albums need 2+ items; a lone item goes out directly with no InputMedia wrapper
+    if len(items) == 1:
+        it = items[0]
+        func = bot.send_photo if it.type == "photo" else bot.send_video
+        return [await func(chat_id, it.file_id, caption=caption or None, parse_mode=None)]
+    return await bot.send_media_group(chat_id, media or build_media(items, caption))
+
+async def send_pending(chat_id: int, p: dict) -> list:
+    # Forward and approve_all send the same album, so its InputMedia list is built
+    # once and kept on the row (the models are frozen, so reuse is safe)
+    items = p["payload"].items
+    if len(items) > 1 and "media" not in p:
+        p["media"] = build_media(items, p.get("caption"))
+    return await send_media(chat_id, items, p.get("caption"), p.get("media"))
 
 # ====================== FORWARD ======================
-async def forward_to_approval(pid: int):
-    p = get_pending(pid)
+def approval_text(pid: int, p: dict) -> str:
+    return f"New submission from {p['mention']} \\(ID: {pid}\\)"
+
+async def forward_to_approval(pid: int, p: dict | None = None):
+    if p is None:
+        p = await get_pending(pid)
     if not p:
         return
 
-    items = p["payload"]["items"]
-    media = []
-    for it in items:
-        if it["type"] == "photo":
-            media.append(types.InputMediaPhoto(media=it["file_id"]))
-        else:
-            media.append(types.InputMediaVideo(media=it["file_id"]))
-    if p.get("caption"):
-        media[0].caption = p["caption"]
-
     reply_to = None
     try:
-        sent = await bot.send_media_group(int(APPROVAL_GROUP_ID), media)
+        sent = await send_pending(APPROVAL_GROUP_ID_INT, p)
         reply_to = sent[0].message_id
     except Exception as e:
-        logger.error(f"Forward failed: {e}")
+        logger.error("Forward failed: %s", e)
 
     await bot.send_message(
-        int(APPROVAL_GROUP_ID),
-        f"New submission from {mention(p['user_id'], p['username'], p['full_name'])} (ID: {pid})",
+        APPROVAL_GROUP_ID_INT,
+        approval_text(pid, p),
         reply_markup=approval_kb(pid),
         reply_to_message_id=reply_to,
         disable_web_page_preview=True
     )
 
 # ====================== MESSAGE HANDLER ======================
-@dp.message()
-async def handle_message(msg: types.Message):
-    if not msg.from_user or msg.from_user.is_bot:
-        return
-    if str(msg.chat.id) != MAIN_GROUP_ID:
-        return
-    if msg.from_user.id in ADMIN_IDS:
-        return
-
-    # ALBUM
-    if msg.media_group_id:
-        key = f"{msg.chat.id}:{msg.media_group_id}"
-        if msg.photo:
-            file_id = msg.photo[-1].file_id
-            typ = "photo"
-        elif msg.video:
-            file_id = msg.video.file_id
-            typ = "video"
-        else:
-            return
-
-        media_buffer.setdefault(key, []).append({"file_id": file_id, "type": typ})
-
-        meta = album_meta.setdefault(key, {})
-        if "user_id" not in meta:
-            meta.update({
-                "user_id": msg.from_user.id,
-                "username": msg.from_user.username,
-                "full_name": msg.from_user.full_name,
-                "chat_id": msg.chat.id,
-                "media_group_id": str(msg.media_group_id)
-            })
-        if msg.caption and "caption" not in meta:
-            meta["caption"] = msg.caption
-
-        try:
-            await msg.delete()
-        except:
-            pass
-
-        if key in flush_tasks:
-            flush_tasks[key].cancel()
-        flush_tasks[key] = asyncio.create_task(flush_album(key))
-        return
+# Only photo/video posts by regular members of the main group reach a handler; other chats
+# (including the approval group), bots, anonymous senders and admins are filtered out
+SUBMISSION = (
+    F.chat.id == MAIN_GROUP_ID_INT,
+    F.from_user.is_bot.is_(False),
+    ~F.from_user.id.in_(ADMIN_IDS),
+    F.photo | F.video
+)
+
+def media_item(msg: types.Message) -> Item:
+    if msg.photo:
+        return Item(msg.photo[-1].file_id, "photo")
+    return Item(msg.video.file_id, "video")
+
+async def safe_delete(msg: types.Message):
+    # Runs in the background; removing the original is independent of the approval flow
+    try:
+        await msg.delete()
+    except:
+        pass
 
-    # SINGLE PHOTO/VIDEO
-    if msg.photo or msg.video:
-        file_id = msg.photo[-1].file_id if msg.photo else msg.video.file_id
-        typ = "photo" if msg.photo else "video"
-        caption = msg.caption or ""
-        payload = {"items": [{"file_id": file_id, "type": typ}]}
-        pid = save_pending(str(msg.chat.id), msg.from_user.id, msg.from_user.username,
-                          msg.from_user.full_name, None, False, caption, payload)
-        await forward_to_approval(pid)
-        try:
-            await msg.delete()
-        except:
-            pass
+# ALBUM
+@dp.message(*SUBMISSION, F.media_group_id)
+async def handle_album(msg: types.Message):
+    key = f"{msg.chat.id}:{msg.media_group_id}"
+    state = albums.get(key)
+    if state is None:
+        state = albums[key] = AlbumState(meta={
+            "user_id": msg.from_user.id,
+            "username": msg.from_user.username,
+            "full_name": msg.from_user.full_name,
+            "chat_id": msg.chat.id,
+            "media_group_id": str(msg.media_group_id)
+        })
+    state.items.append(media_item(msg))
+    if msg.caption and "caption" not in state.meta:
+        state.meta["caption"] = msg.caption
+    state.deadline = asyncio.get_running_loop().time() + MEDIA_TIMEOUT
+    if state.task is None:
+        state.task = spawn(flush_album(key))
+    spawn(safe_delete(msg))
+
+# SINGLE PHOTO/VIDEO
+@dp.message(*SUBMISSION, ~F.media_group_id)
+async def handle_single(msg: types.Message):
+    spawn(safe_delete(msg))
+    payload = Payload(items=[media_item(msg)])
+    pid, p = await save_pending(str(msg.chat.id), msg.from_user.id, msg.from_user.username,
+                                msg.from_user.full_name, None, False, msg.caption or "", payload)
+    await forward_to_approval(pid, p)
 
 # ====================== CALLBACKS ======================
-@dp.callback_query(lambda c: c.data and c.data.startswith("approve_all:"))
-async def approve_all(cb: types.CallbackQuery):
-    pid = int(cb.data.split(":")[1])
-    p = get_pending(pid)
+async def approve_all(cb: types.CallbackQuery, data: ApprovalCB):
+    pid = data.pid
+    p = await get_pending(pid)
     if not p:
         return await cb.answer("Not found", show_alert=True)
 
-    media = []
-    for it in p["payload"]["items"]:
-        m = types.InputMediaPhoto(media=it["file_id"]) if it["type"] == "photo" else types.InputMediaVideo(media=it["file_id"])
-        if not media and p.get("caption"):
-            m.caption = p["caption"]
-        media.append(m)
-
-    await bot.send_media_group(int(MAIN_GROUP_ID), media)
-    await bot.send_message(int(MAIN_GROUP_ID), f"Media submitted by {mention(p['user_id'], p['username'], p['full_name'])}",
-                          parse_mode="MarkdownV2"
-                          )
-    delete_pending(pid)
+    await send_pending(MAIN_GROUP_ID_INT, p)
+    await bot.send_message(MAIN_GROUP_ID_INT, f"Media submitted by {p['mention']}")
+    await delete_pending(pid)
+    selective_selections.pop(pid, None)
     await cb.message.edit_text("Approved & posted")
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("reject_all:"))
-async def reject_all(cb: types.CallbackQuery):
-    pid = int(cb.data.split(":")[1])
-    if get_pending(pid):
-        delete_pending(pid)
+async def reject_all(cb: types.CallbackQuery, data: ApprovalCB):
+    pid = data.pid
+    # DELETE of a missing id is a no-op, so no need to load the row first
+    await delete_pending(pid)
+    selective_selections.pop(pid, None)
     await cb.message.edit_text("Rejected")
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("selective:"))
-async def selective(cb: types.CallbackQuery):
-    pid = int(cb.data.split(":")[1])
-    p = get_pending(pid)
+async def selective(cb: types.CallbackQuery, data: ApprovalCB):
+    pid = data.pid
+    p = await get_pending(pid)
     if not p:
         return
-    selective_selections[pid] = {}
-    for idx, it in enumerate(p["payload"]["items"]):
-        kb = keep_remove_kb(pid, idx)
-        if it["type"] == "photo":
-            await bot.send_photo(int(APPROVAL_GROUP_ID), it["file_id"], caption=f"Item {idx+1}", reply_markup=kb)
-        else:
-            await bot.send_video(int(APPROVAL_GROUP_ID), it["file_id"], caption=f"Item {idx+1}", reply_markup=kb)
-    await cb.message.edit_text("Select items to keep/remove")
-
-@dp.callback_query(lambda c: c.data and (c.data.startswith("keep:") or c.data.startswith("remove:")))
-async def keep_remove(cb: types.CallbackQuery):
-    _, pid_str, idx_str = cb.data.split(":")
-    pid, idx = int(pid_str), int(idx_str)
-    selective_selections.setdefault(pid, {})[idx] = cb.data.startswith("keep:")
-    await cb.answer("Kept" if cb.data.startswith("keep:") else "Removed")
-
-    p = get_pending(pid)
-    if p and len(selective_selections[pid]) == len(p["payload"]["items"]):
-        await bot.send_message(int(APPROVAL_GROUP_ID), "All items reviewed — finalize?", reply_markup=finalize_kb(pid))
-
-@dp.callback_query(lambda c: c.data and c.data.startswith("finalize:"))
-async def finalize(cb: types.CallbackQuery):
-    pid = int(cb.data.split(":")[1])
-    p = get_pending(pid)
+    items = p["payload"].items
+    n = len(items)
+    # Cache the item count so toggle clicks don't have to re-read the row
+    entry = start_selection(pid, n)
+
+    # The items go out once as a numbered album; the review itself is one toggle keyboard
+    media = [
+        INPUT_MEDIA[it.type](media=it.file_id, caption=f"Item {idx+1}/{n}", parse_mode=None)
+        for idx, it in enumerate(items)
+    ]
+    try:
+        try:
+            await send_media(APPROVAL_GROUP_ID_INT, items, "Item 1/1", media)
+        except TelegramRetryAfter as e:
+            # Flood control: wait as told and try once more
+            await asyncio.sleep(e.retry_after)
+            await send_media(APPROVAL_GROUP_ID_INT, items, "Item 1/1", media)
+    except Exception as e:
+        logger.error("Selective send failed (pid %s): %s", pid, e)
+    await show_review(cb, pid, p, entry)
+
+async def show_review(cb: types.CallbackQuery, pid: int, p: dict, entry: Selection):
+    # Keep who/which submission this is; the instructions go underneath
+    await cb.message.edit_text(
+        f"{approval_text(pid, p)}\nTap items to keep/remove, then finalize",
+        reply_markup=toggle_kb(pid, entry),
+        disable_web_page_preview=True
+    )
+
+def selection_from_markup(pid: int, markup) -> Selection | None:
+    # The toggle keyboard shows every item's state, so a lost selection is read back from it
+    total = seen = kept = 0
+    for row in markup.inline_keyboard if markup else ():
+        for button in row:
+            if not (button.callback_data or "").startswith("a:toggle:"):
+                continue
+            bit = 1 << ApprovalCB.unpack(button.callback_data).idx
+            total += 1
+            seen |= bit
+            if button.text.endswith("✓"):
+                kept |= bit
+    return start_selection(pid, total, seen, kept) if total else None
+
+async def load_selection(pid: int, markup=None) -> Selection | None:
+    entry = selective_selections.get(pid)
+    if entry is not None:
+        selective_selections.move_to_end(pid)
+        return entry
+    # Selection lost to a restart or eviction: the toggle keyboard still has it
+    entry = selection_from_markup(pid, markup)
+    if entry is not None:
+        return entry
+    # Old per-item Keep/Remove reviews: only the count can be rebuilt
+    p = await get_pending(pid)
+    if not p:
+        return None
+    entry = start_selection(pid, len(p["payload"].items))
+    entry.rebuilt = True
+    return entry
+
+async def toggle(cb: types.CallbackQuery, data: ApprovalCB):
+    pid, idx = data.pid, data.idx
+    entry = await load_selection(pid, cb.message.reply_markup)
+    if entry is None:
+        return await cb.answer("Not found", show_alert=True)
+    keep = not entry.kept_mask() >> idx & 1
+    entry.mark(idx, keep)
+    await cb.answer("Kept" if keep else "Removed")
+    await cb.message.edit_reply_markup(reply_markup=toggle_kb(pid, entry))
+
+async def keep_remove(cb: types.CallbackQuery, data: ApprovalCB, keep: bool):
+    # Per-item Keep/Remove buttons from reviews started before the toggle keyboard
+    pid, idx = data.pid, data.idx
+    entry = await load_selection(pid)
+    if entry is None:
+        return await cb.answer("Not found", show_alert=True)
+    entry.mark(idx, keep)
+    await cb.answer("Kept" if keep else "Removed")
+
+    if entry.seen.bit_count() == entry.total:
+        await bot.send_message(APPROVAL_GROUP_ID_INT, "All items reviewed — finalize?", reply_markup=finalize_kb(pid))
+
+async def finalize(cb: types.CallbackQuery, data: ApprovalCB):
+    pid = data.pid
+    p = await get_pending(pid)
     if not p:
         return
 
-    sel = selective_selections.get(pid, {})
-    approved = []
-    for idx, it in enumerate(p["payload"]["items"]):
-        if sel.get(idx, True):
-            m = types.InputMediaPhoto(media=it["file_id"]) if it["type"] == "photo" else types.InputMediaVideo(media=it["file_id"])
-            if not approved and p.get("caption"):
-                m.caption = p["caption"]
-            approved.append(m)
+    entry = selective_selections.get(pid) or selection_from_markup(pid, cb.message.reply_markup)
+    if entry is None or entry.rebuilt:
+        # Choices made on old per-item messages were lost; never guess "keep everything"
+        await cb.answer("Selection was lost, please review again", show_alert=True)
+        return await show_review(cb, pid, p, start_selection(pid, len(p["payload"].items)))
+    mask = entry.kept_mask()
+    approved = [it for idx, it in enumerate(p["payload"].items) if mask >> idx & 1]
 
     if approved:
-        if len(approved) > 1:
-            await bot.send_media_group(int(MAIN_GROUP_ID), approved)
-        else:
-            m = approved[0]
-            func = bot.send_photo if isinstance(m, types.InputMediaPhoto) else bot.send_video
-            await func(int(MAIN_GROUP_ID), m.media, caption=m.caption or None)
-        await bot.send_message(int(MAIN_GROUP_ID), f"Media submitted by {mention(p['user_id'], p['username'], p['full_name'])}",
-                              parse_mode="MarkdownV2"
-                              )
-
-    delete_pending(pid)
+        await send_media(MAIN_GROUP_ID_INT, approved, p.get("caption"))
+        await bot.send_message(MAIN_GROUP_ID_INT, f"Media submitted by {p['mention']}")
+
+    await delete_pending(pid)
     selective_selections.pop(pid, None)
     await cb.message.edit_text("Selective approval completed")
 
+CALLBACK_HANDLERS = {
+    "approve_all": approve_all,
+    "reject_all": reject_all,
+    "selective": selective,
+    "toggle": toggle,
+    "keep": partial(keep_remove, keep=True),
+    "remove": partial(keep_remove, keep=False),
+    "finalize": finalize,
+}
+
+@dp.callback_query(ApprovalCB.filter())
+async def route_callback(cb: types.CallbackQuery, callback_data: ApprovalCB):
+    handler = CALLBACK_HANDLERS.get(callback_data.action)
+    if handler:
+        await handler(cb, callback_data)
+
+@dp.callback_query(F.data.regexp(r"^[a-z_]+:\d+(:\d+)?$"))
+async def route_legacy_callback(cb: types.CallbackQuery):
+    # Buttons posted before ApprovalCB ("<action>:<pid>[:<idx>]") keep working
+    action, pid, *idx = cb.data.split(":")
+    await route_callback(cb, ApprovalCB(action=action, pid=int(pid), idx=int(idx[0]) if idx else -1))
+
 # ====================== RUN ======================
+async def run_webhook():
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, handle_in_background=False, secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info("Webhook listening on :%s%s", PORT, WEBHOOK_PATH)
+    # Platforms stop dynos/containers with SIGTERM; turn it into a clean shutdown so the
+    # finally blocks (and close_db's spill of in-RAM submissions) still run
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        handles_sigterm = True
+    except NotImplementedError:
+        # Windows loops have no signal handlers; Ctrl+C still unwinds via asyncio.Runner
+        handles_sigterm = False
+    try:
+        await stop.wait()
+    finally:
+        if handles_sigterm:
+            loop.remove_signal_handler(signal.SIGTERM)
+        await runner.cleanup()
+
 async def main():
+    await init_db()
     logger.info("MEDIA APPROVAL BOT STARTED – EVERYTHING WORKS")
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await close_db()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop else None) as runner:
+        runner.run(main())